@@ -0,0 +1,295 @@
+"""
+Times the stages of nx.Night on a synthetic night.
+
+usage:
+
+    export PYTHONPATH=../nextra/src:my_setupfiles
+    python benchmarks/bench_night.py settings_narval_vega2018 --save bench.json
+    python benchmarks/bench_night.py settings_narval_vega2018 --compare bench.json
+
+The stages are lazily computed by nextra, so accessing them one after
+the other measures each stage on top of the previous ones. The store is
+redirected to a temporary directory so nothing is reused between runs.
+The frames of each settings module are synthesized and reduced in two
+fresh processes, so the memory numbers only contain the reduction of
+that settings module. rss_highwater_mb of a stage is the high-water
+mark of the process RSS once the stage finished, i.e. cumulative over
+all stages so far; it only grows when a stage needs more than every
+earlier one. Frames and store are removed afterwards unless --data is
+given.
+With --compare the script exits with status 1 if a stage got slower
+than the reference by more than --tolerance, failed, or is missing.
+Stages shorter than --min-seconds both here and in the reference are
+not compared, their timings are mostly noise.
+
+With --trace-memory each stage also records peak_alloc_mb, the peak of
+the memory allocated by Python and numpy during this stage alone, on
+top of what earlier stages still hold (tracemalloc). Tracing slows the reduction down, so it cannot be
+combined with --save or --compare either.
+
+With --profile DIR each stage additionally runs under cProfile; the
+stats are dumped as DIR/<settings>.<stage>.prof (readable by pstats,
+snakeviz or flameprof) and the most expensive nextra functions are
+listed in the json. The timings then include the profiler overhead, so
+--profile cannot be combined with --save or --compare.
+"""
+import argparse
+import contextlib
+import cProfile
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import pstats
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../my_setupfiles"))
+
+import nextra as nx
+import synthetic
+
+
+def rss_highwater_mb():
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r / 1024**2 if sys.platform == "darwin" else r / 1024
+
+
+def stages(N, orders):
+    """
+    the stages in the order in which they are triggered, as in src/test.py
+    """
+    s = {}
+
+    def star():
+        s["star"] = N.star4[0]
+
+    return [
+        ("star", star),
+        ("masterflat", lambda: s["star"].masterflat),
+        ("beams", lambda: [s["star"].beams[o] for o in orders]),
+        ("bare_voie1", lambda: [s["star"].bare_voie1[o] for o in orders]),
+        ("voie1", lambda: [s["star"].voie1[o] for o in orders]),
+        ("blaze", lambda: [s["star"].beams[o].beam_sum_blaze(s["star"].masterflat) for o in orders]),
+        ("stokes", lambda: N.stokes.intensity),
+    ]
+
+
+def hotspots(profiler, n=15):
+    """
+    call counts and times of the n most expensive nextra functions
+    """
+    stats = pstats.Stats(profiler).stats
+    root = os.path.dirname(os.path.abspath(nx.__file__)) + os.sep
+    rows = [
+        {
+            "function": f"{os.path.basename(file)}:{line}:{func}",
+            "calls": nc,
+            "tottime_s": tt,
+            "cumtime_s": ct,
+        }
+        for (file, line, func), (cc, nc, tt, ct, callers) in stats.items()
+        if os.path.abspath(file).startswith(root)
+    ]
+    return sorted(rows, key=lambda r: r["cumtime_s"], reverse=True)[:n]
+
+
+def in_subprocess(func, *args):
+    """
+    runs func(*args) in a fresh interpreter and returns its result
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(func, *args).result()
+
+
+def synthesize(settings, path, nseq=1):
+    kwargs = importlib.import_module(settings).get_kwargs()
+    t = time.perf_counter()
+    synthetic.make_night(path, kwargs, nseq=nseq)
+    return time.perf_counter() - t
+
+
+def run(settings, path, profile=None, trace_memory=False):
+    kwargs = importlib.import_module(settings).get_kwargs()
+    with tempfile.TemporaryDirectory(prefix="nextra_bench_store_") as store:
+        kwargs["STORE_PATH"] = store
+        if trace_memory:
+            tracemalloc.start()
+        return run_stages(settings, path, kwargs, profile)
+
+
+def traced_mb():
+    """
+    traced memory now, and starts a new peak measurement
+    """
+    tracemalloc.reset_peak()
+    return tracemalloc.get_traced_memory()[0] / 1024**2
+
+
+def peak_alloc_mb(start):
+    """
+    peak of the traced memory since traced_mb() returned start, on top
+    of start
+    """
+    return tracemalloc.get_traced_memory()[1] / 1024**2 - start
+
+
+def run_stages(settings, path, kwargs, profile=None):
+    tracing = tracemalloc.is_tracing()
+    result = {
+        "settings": settings,
+        "instrument": kwargs["INSTRUMENT"],
+        "shape": [kwargs["NROWS"], kwargs["NCOLS"]],
+        "n_orders": len(kwargs["ORDERS"]),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "baseline_rss_mb": rss_highwater_mb(),
+        "profiled": bool(profile),
+        "trace_memory": tracing,
+        "stages": {},
+    }
+
+    m = traced_mb() if tracing else None
+    t = time.perf_counter()
+    try:
+        N = nx.Night(path, **kwargs)
+    except Exception as e:
+        result["stages"]["night"] = {"error": repr(e)}
+        return result
+    result["stages"]["night"] = {
+        "wall_s": time.perf_counter() - t,
+        "rss_highwater_mb": rss_highwater_mb(),
+    }
+    if tracing:
+        result["stages"]["night"]["peak_alloc_mb"] = peak_alloc_mb(m)
+    for name, stage in stages(N, kwargs["ORDERS"]):
+        profiler = cProfile.Profile() if profile else None
+        m = traced_mb() if tracing else None
+        t0, c0 = time.perf_counter(), time.process_time()
+        try:
+            if profiler:
+                profiler.runcall(stage)
+            else:
+                stage()
+        except Exception as e:  # later stages depend on this one
+            result["stages"][name] = {"error": repr(e)}
+            break
+        result["stages"][name] = {
+            "wall_s": time.perf_counter() - t0,
+            "cpu_s": time.process_time() - c0,
+            "rss_highwater_mb": rss_highwater_mb(),
+        }
+        if tracing:
+            result["stages"][name]["peak_alloc_mb"] = peak_alloc_mb(m)
+        if profiler:
+            profiler.dump_stats(os.path.join(profile, f"{settings}.{name}.prof"))
+            result["stages"][name]["hotspots"] = hotspots(profiler)
+
+    voie1 = result["stages"].get("voie1", {})
+    if "wall_s" in voie1:
+        result["extraction_rows_per_s"] = (
+            kwargs["NROWS"] * len(kwargs["ORDERS"]) / voie1["wall_s"]
+        )
+    return result
+
+
+def compare(result, reference, tolerance, min_seconds=0.0):
+    """
+    returns the list of stages slower than reference * (1 + tolerance),
+    failed, or missing while present in the reference; stages below
+    min_seconds in both runs are not checked for speed
+    """
+    bad = []
+    for name, ref in reference.get("stages", {}).items():
+        if "wall_s" not in ref:
+            continue
+        r = result["stages"].get(name)
+        if r is None:
+            print(f"{name:12s} missing")
+            bad.append(name)
+        elif "wall_s" not in r:
+            print(f"{name:12s} failed: {r.get('error')}")
+            bad.append(name)
+        elif max(r["wall_s"], ref["wall_s"]) < min_seconds:
+            print(f"{name:12s} {r['wall_s']:9.3f}s  ref {ref['wall_s']:9.3f}s  below --min-seconds")
+        elif ref["wall_s"] > 0:
+            ratio = r["wall_s"] / ref["wall_s"]
+            print(f"{name:12s} {r['wall_s']:9.3f}s  ref {ref['wall_s']:9.3f}s  x{ratio:5.2f}")
+            if ratio > 1 + tolerance:
+                bad.append(name)
+    return bad
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    p.add_argument("settings", nargs="+", help="settings modules from my_setupfiles")
+    p.add_argument("--data", default=None, help="directory for the synthetic frames")
+    p.add_argument("--nseq", type=int, default=1, help="number of Stokes sequences")
+    p.add_argument("--save", default=None, help="write results as json")
+    p.add_argument("--compare", default=None, help="reference json for regression check")
+    p.add_argument("--tolerance", type=float, default=0.2)
+    p.add_argument("--min-seconds", type=float, default=0.05,
+                   help="do not compare stages shorter than this")
+    p.add_argument("--profile", default=None, help="directory for per stage cProfile dumps")
+    p.add_argument("--trace-memory", action="store_true",
+                   help="record the peak allocation of each stage with tracemalloc")
+    args = p.parse_args(argv)
+    if (args.profile or args.trace_memory) and (args.save or args.compare):
+        p.error("--profile and --trace-memory slow the reduction down, "
+                "do not combine with --save or --compare")
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+    reference = None
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+        for settings, ref in reference.items():
+            if ref.get("profiled") or ref.get("trace_memory"):
+                p.error(f"{args.compare}: {settings} was run with --profile or "
+                        "--trace-memory, its timings cannot be compared")
+
+    results = {}
+    for settings in args.settings:
+        if args.data:
+            data = contextlib.nullcontext(args.data)
+        else:
+            data = tempfile.TemporaryDirectory(prefix="nextra_bench_")
+        with data as base:
+            path = os.path.join(base, settings)
+            synthesis_s = in_subprocess(synthesize, settings, path, args.nseq)
+            results[settings] = in_subprocess(
+                run, settings, path, args.profile, args.trace_memory
+            )
+            results[settings]["synthesis_s"] = synthesis_s
+
+    print(json.dumps(results, indent=2))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if reference is not None:
+        bad = []
+        for settings, result in results.items():
+            if settings not in reference:
+                print(f"--- {settings} not in reference")
+                bad.append(settings)
+                continue
+            print(f"--- {settings}")
+            bad += [
+                f"{settings}:{s}"
+                for s in compare(result, reference[settings], args.tolerance, args.min_seconds)
+            ]
+        if bad:
+            print("slower, failed or missing compared to reference:", ", ".join(bad))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+Synthetic echelle frames for benchmarking the reduction.
+
+The frames only have to look like real NARVAL / NEO-Narval exposures to
+the pipeline: the geometry (NROWS, NCOLS, CENTRALROW, CENTRALPOSITION,
+VOIE*WIDTH) is taken from a settings module of my_setupfiles, the orders
+are curved beams with two voies on each side of the separator, the
+ThAr frames carry narrow emission lines and the star frames a Vega-like
+continuum with broad Balmer lines.
+
+The numbers are not meant to produce a scientifically correct
+reduction, only to exercise every stage with realistic array sizes.
+"""
+import datetime
+import os
+import numpy as np
+from astropy.io import fits
+
+# product order * wavelength in nm, approximately constant for an echelle
+M_LAMBDA = 22900.0
+# Balmer lines (nm) for the Vega-like spectrum
+BALMER = [656.28, 486.13, 434.05, 410.17, 397.01, 388.91]
+
+# file name suffixes of the NARVAL archive
+KIND_SUFFIX = {"bias": "b", "flat": "f", "thar": "c", "star": "o"}
+STOKES_SEQUENCE = ["V", "V", "V", "V"]
+
+# start of the synthetic night per instrument, frames follow each other
+NIGHT_START = {
+    "NARVAL": datetime.datetime(2018, 1, 1, 18, 0, 0),
+    "NEONARVAL": datetime.datetime(2024, 1, 1, 18, 0, 0),
+}
+READOUT = datetime.timedelta(seconds=60)
+
+
+def order_geometry(kwargs):
+    """
+    returns the rows and, for each order, the column of the separator
+    along the rows
+    """
+    rows = np.arange(kwargs["NROWS"])
+    t = (rows - kwargs["CENTRALROW"]) / kwargs["NROWS"]
+    pos = {
+        o: c + kwargs.get("CENTRALPOSITIONSHIFT", 0) + 8.0 * t + 12.0 * t**2
+        for o, c in kwargs["CENTRALPOSITION"].items()
+    }
+    return rows, pos
+
+
+def wavelength(o, rows, kwargs):
+    """
+    rough grating equation lambda(o, row) in nm
+    """
+    lam0 = M_LAMBDA / o
+    fsr = lam0 / o
+    return lam0 + 1.2 * fsr * (rows - kwargs["CENTRALROW"]) / kwargs["NROWS"]
+
+
+def blaze(o, rows, kwargs):
+    x = (rows - kwargs["CENTRALROW"]) / (0.45 * kwargs["NROWS"])
+    return np.clip(1.0 - x**2, 0.05, None) * (0.5 + o / (2.0 * max(kwargs["ORDERS"])))
+
+
+def thar_lines(kwargs, seed=0, density=0.08):
+    """
+    random catalogue of emission lines (nm) covering all orders
+    """
+    rng = np.random.default_rng(seed)
+    orders = np.array(kwargs["ORDERS"])
+    lmin = M_LAMBDA / orders.max() * (1 - 1.0 / orders.max())
+    lmax = M_LAMBDA / orders.min() * (1 + 1.0 / orders.min())
+    n = int(density * kwargs["NROWS"] * len(orders))
+    return np.sort(rng.uniform(lmin, lmax, n)), rng.uniform(0.05, 1.0, n)
+
+
+def vega_like(lam):
+    spec = np.ones_like(lam)
+    for l0 in BALMER:
+        spec -= 0.6 / (1.0 + ((lam - l0) / 0.8) ** 2)
+    return spec
+
+
+def render(kwargs, kind, flux=30000.0, seed=0):
+    """
+    renders one frame of the given kind ('bias', 'flat', 'thar', 'star')
+    as a float32 array of shape (NROWS, NCOLS)
+    """
+    rng = np.random.default_rng(seed)
+    nrows, ncols = kwargs["NROWS"], kwargs["NCOLS"]
+    frame = np.full((nrows, ncols), 300.0, dtype=np.float32)
+    if kind != "bias":
+        rows, pos = order_geometry(kwargs)
+        cols = np.arange(ncols)
+        if kind == "thar":
+            lines, strength = thar_lines(kwargs)
+        for o, p in pos.items():
+            lo = int(max(p.min() - kwargs["VOIE2WIDTH"] - 3, 0))
+            hi = int(min(p.max() + kwargs["VOIE1WIDTH"] + 4, ncols))
+            if hi <= lo:
+                continue
+            c = cols[lo:hi][None, :]
+            d = c - p[:, None]
+            # two voies, left and right of the separator
+            w1, w2 = kwargs["VOIE1WIDTH"], kwargs["VOIE2WIDTH"]
+            profile = np.exp(-0.5 * ((d - 0.5 * w1) / (0.3 * w1)) ** 4)
+            profile += np.exp(-0.5 * ((d + 0.5 * w2 + 1) / (0.3 * w2)) ** 4)
+            f = flux * blaze(o, rows, kwargs)
+            if kind == "thar":
+                lam = wavelength(o, rows, kwargs)
+                dl = np.abs(np.gradient(lam))
+                i = np.searchsorted(lines, [lam.min(), lam.max()])
+                spec = np.full_like(lam, 0.002)
+                for l0, s in zip(lines[i[0]:i[1]], strength[i[0]:i[1]]):
+                    spec += s * np.exp(-0.5 * ((lam - l0) / (1.2 * dl)) ** 2)
+                f = f * spec
+            elif kind == "star":
+                f = 0.3 * f * vega_like(wavelength(o, rows, kwargs))
+            frame[:, lo:hi] += (f[:, None] * profile).astype(np.float32)
+    frame += rng.normal(0.0, 5.0, frame.shape).astype(np.float32)
+    if kind != "bias":
+        frame += np.sqrt(np.clip(frame, 0, None)) * rng.standard_normal(
+            frame.shape, dtype=np.float32
+        )
+    return frame
+
+
+def exptime(kwargs, kind, i=0):
+    """
+    bias 0 s, flats alternating HIGHEXP / LOWEXP, stars HIGHEXP, ThAr 10 s
+    """
+    if kind == "bias":
+        return 0.0
+    if kind == "flat":
+        return float(kwargs["HIGHEXP"] if i % 2 == 0 else kwargs["LOWEXP"])
+    if kind == "star":
+        return float(kwargs["HIGHEXP"])
+    return 10.0
+
+
+def header(kwargs, kind, date, exposure, iseq=0, ifile=0):
+    h = fits.Header()
+    h["OBSTYPE"] = kind.upper()
+    h["OBJECT"] = "VEGA" if kind == "star" else kind.upper()
+    h["EXPTIME"] = exposure
+    h[kwargs["DATEOBS"]] = date.isoformat(timespec="seconds")
+    if kind == "star":
+        h[kwargs["SEQIDENT"]] = iseq + 1
+        h[kwargs["FILEINSEQ"]] = ifile + 1
+        h[kwargs["STOKENAME"]] = STOKES_SEQUENCE[ifile]
+        if kwargs.get("NUMSEQ"):
+            h[kwargs["NUMSEQ"]] = len(STOKES_SEQUENCE)
+    return h
+
+
+def filename(kwargs, kind, number, date):
+    if kwargs["INSTRUMENT"] == "NARVAL":
+        return f"{number:06d}{KIND_SUFFIX[kind]}.fits"
+    name = {"bias": "bi", "flat": "fl", "thar": "th", "star": "st"}[kind]
+    return f"NEO_{date:%Y%m%d_%H%M%S}_{name}0.fits"
+
+
+def make_night(path, kwargs, nbias=3, nflat=4, nthar=2, nseq=1):
+    """
+    writes a complete synthetic night (bias, flats, ThAr and nseq Stokes
+    sequences of four exposures) into path and returns the file names;
+    the frames are dated one after the other from NIGHT_START on
+    """
+    os.makedirs(path, exist_ok=True)
+    frames = (
+        [("bias", i, 0, 0) for i in range(nbias)]
+        + [("flat", i, 0, 0) for i in range(nflat)]
+        + [("thar", i, 0, 0) for i in range(nthar)]
+        + [("star", 0, s, i) for s in range(nseq) for i in range(len(STOKES_SEQUENCE))]
+    )
+    date = NIGHT_START.get(kwargs["INSTRUMENT"], NIGHT_START["NEONARVAL"])
+    files = []
+    for number, (kind, i, iseq, ifile) in enumerate(frames, start=100000):
+        exposure = exptime(kwargs, kind, i)
+        name = filename(kwargs, kind, number, date)
+        data = render(kwargs, kind, seed=number)
+        fits.PrimaryHDU(data, header(kwargs, kind, date, exposure, iseq, ifile)).writeto(
+            os.path.join(path, name), overwrite=True
+        )
+        files.append(name)
+        date += datetime.timedelta(seconds=exposure) + READOUT
+    return files
@@ -0,0 +1,290 @@
+"""
+Frozen, fingerprinted settings.
+
+.. code-block:: python
+
+    import compiled_settings
+    S = compiled_settings.compile_settings("settings_narval_vega2018")
+    S.fingerprint                  # stable sha256 of all parameters
+    N = nx.Night(path, **S.kwargs())
+
+compile_settings() runs get_kwargs() of the settings module once per
+process and writes a snapshot of the parameters to the __pycache__
+directory next to the module, named after the fingerprint. The
+snapshot also records what get_kwargs() depends on besides the
+fingerprint: the source of the settings module and of the modules next
+to it that it imports, the version and source files of nextra, the
+NEXTRA_* environment variables and the .env file that load_dotenv()
+picks up.
+
+A CompiledSettings object is immutable and hashable: item access
+returns read-only views (mappingproxy, tuple, frozenset, read-only
+arrays) and kwargs() returns a fresh mutable copy for each call. To
+hand settings to a worker process send S.handle, a (module,
+fingerprint) pair, and call from_handle() in the worker. It loads the
+snapshot without running get_kwargs() or importing the settings
+module, and raises ValueError if any recorded input changed since; the
+worker only pays for hashing a few small files and unpickling the
+parameters. Without a snapshot (e.g. read-only __pycache__) it falls
+back to compiling the module and comparing fingerprints.
+"""
+import ast
+import functools
+import glob
+import hashlib
+import importlib
+import importlib.metadata
+import importlib.util
+import inspect
+import os
+import pickle
+import re
+import types
+from collections.abc import Mapping
+
+import numpy as np
+
+_ADDRESS = re.compile(r" at 0x[0-9a-fA-F]+")
+
+
+def _array(a):
+    if a.dtype.hasobject:
+        return (a.shape, tuple(_canonical(x) for x in a.ravel()))
+    data = np.ascontiguousarray(a).tobytes()
+    return (a.dtype.str, a.shape, hashlib.sha256(data).hexdigest())
+
+
+def _canonical(v):
+    """
+    a representation of v that only depends on its content
+    """
+    if isinstance(v, Mapping):
+        return ("dict", tuple(sorted((repr(k), _canonical(x)) for k, x in v.items())))
+    if isinstance(v, (list, tuple)):
+        return (type(v).__name__, tuple(_canonical(x) for x in v))
+    if isinstance(v, (set, frozenset)):
+        return ("set", tuple(sorted(repr(_canonical(x)) for x in v)))
+    if isinstance(v, np.ndarray):
+        kind = f"{type(v).__module__}.{type(v).__qualname__}"
+        if type(v) is np.ndarray:
+            return ("ndarray", kind, _array(v))
+        if isinstance(v, np.ma.MaskedArray):
+            return (
+                "masked", kind,
+                _array(np.ma.getdata(v)), _array(np.ma.getmaskarray(v)),
+            )
+        if hasattr(v, "unit"):  # astropy Quantity and its subclasses
+            return ("quantity", kind, str(v.unit), _array(np.asarray(v)))
+        raise TypeError(f"cannot fingerprint ndarray subclass {kind}")
+    if isinstance(v, type) or inspect.isroutine(v):
+        name = f"{v.__module__}.{v.__qualname__}"
+        if "<lambda>" in name or "<locals>" in name:
+            raise TypeError(f"cannot fingerprint {name}, it is not uniquely named")
+        return ("ref", name)
+    r = repr(v)
+    if _ADDRESS.search(r):
+        raise TypeError(
+            f"cannot fingerprint {type(v).__name__} value, its repr is not content based: {r}"
+        )
+    return (type(v).__name__, r)
+
+
+def fingerprint(kwargs):
+    return hashlib.sha256(repr(_canonical(kwargs)).encode()).hexdigest()
+
+
+def _frozen(v):
+    """
+    a read-only view of v, nested containers included
+    """
+    if isinstance(v, Mapping):
+        return types.MappingProxyType({k: _frozen(x) for k, x in v.items()})
+    if isinstance(v, (list, tuple)):
+        return tuple(_frozen(x) for x in v)
+    if isinstance(v, (set, frozenset)):
+        return frozenset(_frozen(x) for x in v)
+    if isinstance(v, np.ndarray):
+        v = v.copy()
+        v.setflags(write=False)
+    return v
+
+
+class CompiledSettings(Mapping):
+    __slots__ = ("module", "fingerprint", "_blob", "_kwargs")
+
+    def __init__(self, module, kwargs):
+        self.module = module
+        self.fingerprint = fingerprint(kwargs)
+        self._blob = pickle.dumps(kwargs)
+        self._kwargs = {k: _frozen(v) for k, v in pickle.loads(self._blob).items()}
+
+    @property
+    def handle(self):
+        """
+        (module, fingerprint), enough for from_handle() in another process
+        """
+        return self.module, self.fingerprint
+
+    def kwargs(self):
+        """
+        a fresh copy of the parameters, to be passed to nx.Night
+        """
+        return pickle.loads(self._blob)
+
+    def __getitem__(self, key):
+        return self._kwargs[key]
+
+    def __iter__(self):
+        return iter(self._kwargs)
+
+    def __len__(self):
+        return len(self._kwargs)
+
+    def __hash__(self):
+        return hash(self.fingerprint)
+
+    def __eq__(self, other):
+        if isinstance(other, CompiledSettings):
+            return self.fingerprint == other.fingerprint
+        return NotImplemented
+
+    def __setattr__(self, name, value):
+        if hasattr(self, "_kwargs"):
+            raise AttributeError("CompiledSettings are immutable")
+        object.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        return CompiledSettings, (self.module, self.kwargs())
+
+    def __repr__(self):
+        return f"<CompiledSettings {self.module} {self.fingerprint[:12]}>"
+
+
+def _origin(module):
+    spec = importlib.util.find_spec(module)
+    if spec is None or not spec.origin:
+        raise ModuleNotFoundError(f"settings module {module} not found")
+    return spec.origin
+
+
+def _dotenv(start):
+    """
+    the .env load_dotenv() finds from the settings directory upwards
+    """
+    d = os.path.abspath(start)
+    while True:
+        f = os.path.join(d, ".env")
+        if os.path.isfile(f):
+            return f
+        if os.path.dirname(d) == d:
+            return None
+        d = os.path.dirname(d)
+
+
+def _sources(filename):
+    """
+    filename and the modules next to it that it imports, recursively
+    """
+    here = os.path.dirname(filename)
+    todo, found = [filename], set()
+    while todo:
+        f = todo.pop()
+        if f in found:
+            continue
+        found.add(f)
+        with open(f, "rb") as fh:
+            tree = ast.parse(fh.read(), f)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                sibling = os.path.join(here, name.split(".")[0] + ".py")
+                if os.path.isfile(sibling):
+                    todo.append(sibling)
+    return sorted(found)
+
+
+def _inputs(module):
+    """
+    hash of what get_kwargs() depends on besides its own result
+    """
+    origin = _origin(module)
+    here = os.path.dirname(origin)
+    h = hashlib.sha256()
+    for f in _sources(origin):
+        with open(f, "rb") as fh:
+            h.update(f.encode() + b"\0" + fh.read())
+    env = _dotenv(here)
+    if env:
+        with open(env, "rb") as fh:
+            h.update(b"dotenv\0" + fh.read())
+    for k in sorted(os.environ):
+        if k.startswith("NEXTRA"):
+            h.update(f"{k}={os.environ[k]}\0".encode())
+    try:
+        h.update(importlib.metadata.version("nextra").encode())
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    spec = importlib.util.find_spec("nextra")
+    for path in (spec.submodule_search_locations or []) if spec else []:
+        for f in sorted(glob.glob(os.path.join(path, "**", "*.py"), recursive=True)):
+            st = os.stat(f)
+            h.update(f"{f}:{st.st_size}:{st.st_mtime_ns}\0".encode())
+    return h.hexdigest()
+
+
+def _snapshot_file(module, fp):
+    return os.path.join(
+        os.path.dirname(_origin(module)), "__pycache__", f"{module}.settings-{fp}.pickle"
+    )
+
+
+def from_handle(module, expected):
+    """
+    the CompiledSettings with the given fingerprint, raises ValueError
+    if the settings or their inputs changed since they were compiled
+    """
+    try:
+        with open(_snapshot_file(module, expected), "rb") as f:
+            snapshot = pickle.load(f)
+    except OSError:
+        s = CompiledSettings(module, importlib.import_module(module).get_kwargs())
+        if s.fingerprint != expected:
+            raise ValueError(
+                f"settings {module} changed: fingerprint {s.fingerprint[:12]}, "
+                f"expected {expected[:12]}"
+            )
+        return s
+    if snapshot["inputs"] != _inputs(module):
+        raise ValueError(
+            f"settings {module} {expected[:12]}: settings sources, nextra or "
+            "environment changed since they were compiled"
+        )
+    s = CompiledSettings(module, pickle.loads(snapshot["kwargs"]))
+    if s.fingerprint != expected:
+        raise ValueError(f"settings snapshot of {module} {expected[:12]} is corrupt")
+    return s
+
+
+@functools.lru_cache(maxsize=None)
+def compile_settings(module):
+    """
+    returns the CompiledSettings of the settings module given by name
+    and writes its snapshot for from_handle()
+    """
+    s = CompiledSettings(module, importlib.import_module(module).get_kwargs())
+    inputs = _inputs(module)  # after get_kwargs(), load_dotenv() has run
+    snapshot = _snapshot_file(module, s.fingerprint)
+    try:
+        os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+        tmp = f"{snapshot}.{os.getpid()}"
+        with open(tmp, "wb") as f:
+            pickle.dump({"inputs": inputs, "kwargs": s._blob}, f)
+        os.replace(tmp, snapshot)
+    except OSError:  # read only installation, from_handle() recompiles
+        pass
+    return s
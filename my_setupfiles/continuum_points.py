@@ -0,0 +1,75 @@
+"""
+Continuum points of star_params in a versioned .npz format.
+
+The pickled pandas DataFrames (columns true_order_number, lambdagrid)
+need a pandas/numpy close to the one that wrote them; the .npz files
+written by convert() only need numpy.
+
+.. code-block:: python
+
+    import continuum_points
+    points = continuum_points.load_continuum_points(
+        "star_params/vega/vega_narval_continuum_A.npz"
+    )
+    points["lambdagrid"][points["true_order_number"] == 60]
+"""
+import os
+import numpy as np
+
+FORMAT_VERSION = 1
+COLUMNS = {"true_order_number": np.int32, "lambdagrid": np.float64}
+
+
+def load_continuum_points(filename):
+    """
+    returns a dict column name -> array of a converted .npz file
+    """
+    with np.load(filename) as f:
+        version = int(f["format_version"])
+        if version != FORMAT_VERSION:
+            raise ValueError(
+                f"{filename}: continuum points format {version}, expected {FORMAT_VERSION}"
+            )
+        return {c: f[c] for c in COLUMNS}
+
+
+def check(df, points):
+    """
+    raises ValueError unless points holds exactly the columns of df
+    """
+    if set(df.columns) != set(COLUMNS):
+        raise ValueError(f"unexpected columns {list(df.columns)}")
+    for c, t in COLUMNS.items():
+        original = df[c].to_numpy()
+        if len(points[c]) != len(original) or not (
+            np.array_equal(points[c], original.astype(t))
+            # catches values that do not fit the stored type
+            and np.array_equal(points[c].astype(original.dtype), original)
+        ):
+            raise ValueError(f"column {c} differs after conversion")
+
+
+def convert(filename):
+    """
+    writes the .npz next to the pickle filename, checks the round trip
+    and returns the name of the .npz; the .npz only appears once the
+    check passed
+    """
+    import pandas as pd
+
+    df = pd.read_pickle(filename)
+    out = os.path.splitext(filename)[0] + ".npz"
+    tmp = out + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                format_version=np.array(FORMAT_VERSION),
+                **{c: df[c].to_numpy(dtype=t) for c, t in COLUMNS.items()},
+            )
+        check(df, load_continuum_points(tmp))
+        os.replace(tmp, out)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return out
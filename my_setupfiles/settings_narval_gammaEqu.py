@@ -12,7 +12,6 @@ kwargs_xxxx['SETTING_ID'] = 'Moon'
 Alternatively you may copy this module as a template and adapt it
 """
 import os
-import numpy as np
 from dotenv import load_dotenv
 
 import nextra.units as nu
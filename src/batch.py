@@ -0,0 +1,254 @@
+"""
+Reduces many nights in a process pool.
+
+The manifest is a text file with one night per line, the data directory
+and the settings module from my_setupfiles separated by whitespace,
+e.g.
+
+    # data dir                                  settings module
+    ../nextra-data/Vega_narval_test/            settings_narval_vega2018
+    ../nextra-data/Sirius 2011/                 settings_sirius
+    ../nextra-data/Altair_2020/                 settings_altair2020
+
+The settings module is the last word of the line, so the data directory
+may contain spaces or '#'; lines starting with '#' are comments. Nights
+are reduced in the order of the manifest.
+
+usage:
+
+    export PYTHONPATH=../nextra/src:my_setupfiles
+    python src/batch.py manifest.txt --workers 8 --max-memory-gb 6
+
+Finished nights are recorded in the journal file together with the
+fingerprint of their settings, so after a crash the same command only
+reduces the nights not yet done or whose settings changed since; the
+stages of an interrupted night are reused from the __STORE__ of its
+settings.
+
+Nights are not grouped by calibration: each night computes its own
+calibration products. Several settings modules share a STORE_PATH
+(BASEDIR/assets/__STORE__ or USER_BASEDIR/__STORE__), so with more than
+one worker several processes may write to the same store at the same
+time, also for nights of the same settings module. nextra.store does
+not promise to be safe with concurrent writers; the shared stores are
+listed at startup, use --workers 1 or separate STORE_PATHs to be safe.
+
+Each worker leaves a marker in <journal>.running while it reduces a
+night. If a worker dies (segfault, memory limit, killed), the pool is
+recreated: the nights that were running at that moment are reduced
+again one at a time to find the one killing its worker, which is
+journaled as failed, the other unfinished nights go on in parallel.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../my_setupfiles"))
+
+import compiled_settings
+
+
+def read_manifest(filename):
+    nights, seen = [], {}
+    with open(filename) as f:
+        for lineno, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            where = f"{filename}:{lineno}"
+            fields = line.rsplit(None, 1)
+            if len(fields) != 2:
+                raise ValueError(f"{where}: expected '<data dir> <settings module>', got {line!r}")
+            path, module = fields
+            if not module.isidentifier():
+                raise ValueError(f"{where}: {module!r} is not a settings module name")
+            path = os.path.abspath(path)
+            if not os.path.isdir(path):
+                raise ValueError(f"{where}: data directory {path} not found")
+            if (path, module) in seen:
+                raise ValueError(f"{where}: night already listed at line {seen[path, module]}")
+            seen[path, module] = lineno
+            nights.append((path, module))
+    return nights
+
+
+def read_journal(filename):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def write_journal(filename, journal):
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(journal, f, indent=2)
+    os.replace(tmp, filename)
+
+
+def limit_memory(max_memory_gb):
+    if max_memory_gb:
+        limit = int(max_memory_gb * 1024**3)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def default_workers():
+    """
+    a whole night needs several GB, so stay well below one worker per core
+    """
+    return max(1, min(4, (os.cpu_count() or 1) // 4))
+
+
+def marker(running, key):
+    return os.path.join(running, hashlib.sha1(key.encode()).hexdigest())
+
+
+def reduce_night(path, module, fingerprint, running):
+    """
+    runs in a worker: reduces one night up to the Stokes spectra with
+    the settings module, which must still have the given fingerprint
+    """
+    import nextra as nx
+
+    m = marker(running, f"{path}:{module}")
+    with open(m, "w") as f:
+        f.write(f"{path}:{module}")
+    try:
+        settings = compiled_settings.from_handle(module, fingerprint)
+        t = time.perf_counter()
+        N = nx.Night(path, **settings.kwargs())
+        N.stokes  # triggers the full reduction
+        return time.perf_counter() - t
+    finally:
+        os.remove(m)
+
+
+def died_in(running):
+    """
+    keys of the nights whose worker died, and removes their markers
+    """
+    keys = []
+    for name in os.listdir(running):
+        with open(os.path.join(running, name)) as f:
+            keys.append(f.read())
+        os.remove(os.path.join(running, name))
+    return keys
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    p.add_argument("manifest")
+    p.add_argument("--workers", type=int, default=default_workers(),
+                   help="number of nights reduced at the same time")
+    p.add_argument("--max-memory-gb", type=float, default=None,
+                   help="address space limit per worker")
+    p.add_argument("--journal", default=None,
+                   help="json file of finished nights (default: <manifest>.journal)")
+    p.add_argument("--redo", action="store_true", help="ignore the journal")
+    args = p.parse_args(argv)
+
+    journal_file = args.journal or args.manifest + ".journal"
+    journal = {} if args.redo else read_journal(journal_file)
+    todo = []
+    for path, module in read_manifest(args.manifest):
+        settings = compiled_settings.compile_settings(module)
+        entry = journal.get(f"{path}:{module}", {})
+        if entry.get("status") != "done" or entry.get("fingerprint") != settings.fingerprint:
+            todo.append((path, settings))
+    print(f"{len(todo)} nights to reduce with {args.workers} workers")
+    if args.workers > 1:
+        stores = {}
+        for path, settings in todo:
+            stores.setdefault(settings.get("STORE_PATH"), []).append(settings.module)
+        for store, modules in stores.items():
+            if store and len(modules) > 1:
+                print(f"{len(modules)} nights write to store {store} "
+                      f"({', '.join(sorted(set(modules)))})")
+
+    running = journal_file + ".running"
+    os.makedirs(running, exist_ok=True)
+    died_in(running)  # markers of an earlier crashed run
+
+    failed = 0
+    suspects = []  # nights running when a worker died
+    while todo or suspects:
+        # suspects run alone, so a dead worker points to a single night
+        isolating = bool(suspects)
+        batch, workers = (suspects, 1) if isolating else (todo, args.workers)
+        broken = []
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=limit_memory,
+            initargs=(args.max_memory_gb,),
+        ) as pool:
+            futures = {
+                pool.submit(reduce_night, path, *settings.handle, running): (path, settings)
+                for path, settings in batch
+            }
+            for future in as_completed(futures):
+                path, settings = futures[future]
+                key = f"{path}:{settings.module}"
+                try:
+                    seconds = future.result()
+                except BrokenProcessPool:
+                    broken.append((path, settings))
+                    continue
+                except Exception:
+                    failed += 1
+                    journal[key] = {
+                        "fingerprint": settings.fingerprint,
+                        "status": "failed",
+                        "error": traceback.format_exc(),
+                    }
+                    print(f"failed {settings.module} {path}")
+                else:
+                    journal[key] = {
+                        "fingerprint": settings.fingerprint,
+                        "status": "done",
+                        "seconds": seconds,
+                    }
+                    print(f"done   {settings.module} {path} ({seconds:.1f}s)")
+                write_journal(journal_file, journal)
+
+        running_keys = set(died_in(running))
+        if not isolating:
+            if not running_keys:  # no marker left, every unfinished night is suspect
+                running_keys = {f"{n[0]}:{n[1].module}" for n in broken}
+            todo = [n for n in broken if f"{n[0]}:{n[1].module}" not in running_keys]
+            suspects = [n for n in broken if f"{n[0]}:{n[1].module}" in running_keys]
+            if broken:
+                print(f"worker died, retrying {len(suspects)} nights one at a time")
+            continue
+
+        # a single worker died, the one night it was running is the culprit;
+        # without a marker it died before starting, fail them all
+        suspects = []
+        for path, settings in broken:
+            key = f"{path}:{settings.module}"
+            if running_keys and key not in running_keys:
+                suspects.append((path, settings))
+                continue
+            failed += 1
+            journal[key] = {
+                "fingerprint": settings.fingerprint,
+                "status": "failed",
+                "error": "worker process died while reducing this night "
+                         "(crash, killed or --max-memory-gb exceeded)",
+            }
+            print(f"died   {settings.module} {path}")
+        write_journal(journal_file, journal)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
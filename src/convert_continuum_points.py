@@ -0,0 +1,21 @@
+"""
+Converts the pickled continuum points of star_params to .npz files.
+
+usage:
+
+    python src/convert_continuum_points.py star_params/*/*.pickl
+
+writes star_params/vega/vega_narval_continuum_A.npz etc. next to the
+pickles and checks that they hold the same points; load them with
+continuum_points.load_continuum_points() from my_setupfiles.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../my_setupfiles"))
+
+import continuum_points
+
+if __name__ == "__main__":
+    for filename in sys.argv[1:]:
+        print(filename, "->", continuum_points.convert(filename))